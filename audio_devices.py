@@ -0,0 +1,155 @@
+# audio_devices.py
+# Process-wide PortAudio handle and USB audio device detection, shared by the
+# wake word listener and the Gemini Live session.
+
+import atexit
+import ctypes
+import threading
+
+import pyaudio
+
+from config import CONFIG
+from utils import get_logger, audio_thread_snapshot, promote_audio_threads
+
+log = get_logger("AUDIO")
+
+# =========================
+# ALSA Error Silencing
+# =========================
+# ALSA prints a wall of probe errors every time PortAudio initialises. Install a
+# no-op libasound error handler once, process-wide; the reference is kept so the
+# ctypes callback isn't garbage collected while ALSA still points at it.
+_ALSA_ERROR_HANDLER = ctypes.CFUNCTYPE(None, ctypes.c_char_p, ctypes.c_int,
+                                       ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p)
+_alsa_error_handler = None
+
+def _silence_alsa_errors():
+    global _alsa_error_handler
+    try:
+        asound = ctypes.cdll.LoadLibrary("libasound.so.2")
+    except OSError:
+        return  # Not on ALSA (e.g. a dev machine); nothing to silence.
+    _alsa_error_handler = _ALSA_ERROR_HANDLER(lambda *args: None)
+    asound.snd_lib_error_set_handler(_alsa_error_handler)
+
+_silence_alsa_errors()
+
+# =========================
+# Shared PyAudio Instance
+# =========================
+# PortAudio/ALSA init costs hundreds of ms, so one PyAudio instance serves the
+# whole process and is only terminated at exit.
+_pa_lock = threading.Lock()
+_pa = None
+
+def get_pyaudio():
+    """Returns the process-wide PyAudio instance (shared with the wake word listener)."""
+    global _pa
+    with _pa_lock:
+        if _pa is None:
+            _pa = pyaudio.PyAudio()
+        return _pa
+
+def _terminate_pyaudio():
+    global _pa
+    with _pa_lock:
+        if _pa is not None:
+            _pa.terminate()
+            _pa = None
+
+# Registered before any module that opens streams on the instance, so atexit
+# (last in, first out) closes those streams before PortAudio is terminated.
+atexit.register(_terminate_pyaudio)
+
+# =========================
+# USB Audio Detection for Raspberry Pi 5
+# =========================
+# Indices are looked up once on the shared PyAudio instance and remembered; its
+# device list is fixed until PortAudio is re-initialised anyway.
+_device_cache = {}
+# Ranked keyword tiers: a "usb" name wins over a generic "mic"/"speaker", which wins
+# over anything merely called "audio" (e.g. on-board HDMI outputs).
+_MIC_KEYWORDS = (('usb',), ('microphone', 'mic'), ('audio',))
+_SPK_KEYWORDS = (('usb',), ('speaker', 'headphone'), ('audio',))
+
+def _keyword_rank(name, tiers):
+    for rank, keywords in enumerate(tiers):
+        if any(keyword in name for keyword in keywords):
+            return rank
+    return None
+
+def _detect_usb_devices():
+    """Finds the best-ranked USB-looking input and output device in one pass over the device list."""
+    if _device_cache:
+        return _device_cache["microphone"], _device_cache["speaker"]
+    try:
+        p = get_pyaudio()
+        info = p.get_host_api_info_by_index(0)
+        num_devices = info.get('deviceCount')
+        mic_index = spk_index = mic_name = spk_name = None
+        mic_rank, spk_rank = len(_MIC_KEYWORDS), len(_SPK_KEYWORDS)
+
+        for i in range(num_devices):
+            device_info = p.get_device_info_by_host_api_device_index(0, i)
+            device_name = device_info.get('name', '').lower()
+
+            # Look for USB audio devices; the first device in the best tier wins
+            if mic_rank and device_info.get('maxInputChannels') > 0:
+                rank = _keyword_rank(device_name, _MIC_KEYWORDS)
+                if rank is not None and rank < mic_rank:
+                    mic_index, mic_rank, mic_name = i, rank, device_info.get('name')
+            if spk_rank and device_info.get('maxOutputChannels') > 0:
+                rank = _keyword_rank(device_name, _SPK_KEYWORDS)
+                if rank is not None and rank < spk_rank:
+                    spk_index, spk_rank, spk_name = i, rank, device_info.get('name')
+            if mic_rank == 0 and spk_rank == 0:
+                break
+
+        if mic_index is not None:
+            log.info(f"Found USB microphone: Device {mic_index} - {mic_name}")
+        else:
+            log.info("No USB microphone found, using default device")
+        if spk_index is not None:
+            log.info(f"Found USB speaker: Device {spk_index} - {spk_name}")
+        else:
+            log.info("No USB speaker found, using default device")
+        _device_cache.update(microphone=mic_index, speaker=spk_index)
+        return mic_index, spk_index
+
+    except Exception as e:
+        log.error(f"Error detecting USB audio devices: {e}")
+        return None, None
+
+def detect_usb_microphone():
+    """
+    Auto-detect USB microphone device index for Raspberry Pi 5.
+    Returns None if no USB microphone is found.
+    """
+    return _detect_usb_devices()[0]
+
+def detect_usb_speaker():
+    """
+    Auto-detect USB speaker device index for Raspberry Pi 5.
+    Returns None if no USB speaker is found.
+    """
+    return _detect_usb_devices()[1]
+
+# =========================
+# Mic Stream
+# =========================
+# Both the wake word listener (blocking reads) and the Live session (callback mode)
+# open the mic here. Under `main.py --rt` only callback streams have a PortAudio
+# thread to promote: a blocking stream is read on the caller's thread, which for
+# the wake word is the main thread, and that also runs ONNX inference, so it is
+# left pinned to rt_main_cpu on the normal scheduler.
+def open_mic_stream(stream_callback=None):
+    """Opens a mic stream on the shared PyAudio instance (blocking without a callback); the caller closes it."""
+    p = get_pyaudio()
+    threads_before_open = audio_thread_snapshot()
+    mic_stream = p.open(format=CONFIG["audio"]["format"], channels=CONFIG["audio"]["channels"],
+                        rate=CONFIG["audio"]["rate"], input=True,
+                        frames_per_buffer=CONFIG["audio"]["chunk_size"],
+                        input_device_index=detect_usb_microphone(),
+                        stream_callback=stream_callback)
+    promote_audio_threads(threads_before_open)
+    return mic_stream
@@ -23,10 +23,12 @@ CHAT_COLLECTION_NAME = "(default)"
 SIMULATE_MOTOR_HEAD = True
 IDLE_SECONDS = 60
 KEEPALIVE_SECONDS = 10
+MEMORY_FLUSH_SECONDS = 5.0
 RECONNECT_BACKOFF_SECONDS = 0.2
 MAX_BACKOFF_SECONDS = 5.0
 SESSION_SHORT_LIFETIME_S = 5.0
 SESSION_INFINITE_RETRY = True
+RECONNECT_DEADLINE_S = 120.0  # Give up and go back to sleep after this long of failed reconnects
 CONVO_MAX_TURNS = 12
 
 # Hotword targets (desired). We'll auto-filter by what actually exists on disk.
@@ -41,6 +43,7 @@ WAKE_THRESH = {
 }
 POST_SESSION_COOLDOWN_S = 5.0
 ARMING_DELAY_S = 0.8
+DEBUG_WAKE_SCORES = False  # Print live wake-word scores every frame (costly on the Pi)
 
 # =========================
 # Voice Catalog
@@ -160,6 +163,9 @@ CONFIG = {
         "rate": 16000,
         "speaker_rate": 24000,
         "chunk_size": 1280,
+        "playback_max_seconds": 10,  # Max assistant audio buffered for the speaker; oldest is trimmed first
+        "vad_rms_threshold": 300,  # int16 RMS below which a mic chunk counts as silence (0 = send everything)
+        "vad_hangover_chunks": 6,  # Silent chunks still sent after speech so Gemini sees the utterance end
         # Raspberry Pi 5 specific audio settings
         "input_device_index": None,  # Will be auto-detected
         "output_device_index": None,  # Will be auto-detected
@@ -171,6 +177,10 @@ CONFIG = {
         "gpio_status_pin": 18,  # Physical pin 12
         "enable_gpio": True,  # Enable GPIO control
         "enable_usb_audio": True,  # Enable USB audio detection
+        # Realtime scheduling (only applied with `python main.py --rt`, needs CAP_SYS_NICE)
+        "rt_main_cpu": 0,  # Core the Python process / asyncio loop is pinned to
+        "rt_audio_cpu": 1,  # Core PortAudio's callback threads are pinned to
+        "rt_audio_priority": 70,  # SCHED_FIFO priority for PortAudio threads
     }
 }
 
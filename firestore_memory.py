@@ -2,12 +2,24 @@
 # Firestore integration for persistent chat memory using LangChain
 
 import os
+import queue
+import threading
+import time
 import uuid
 from typing import Optional
 from langchain_google_firestore import FirestoreChatMessageHistory
 from langchain.memory import ConversationBufferMemory
-from langchain.schema import BaseMessage
+from langchain.schema import BaseMessage, HumanMessage, AIMessage
 from config import FIRESTORE_PROJECT_ID, CHAT_COLLECTION_NAME
+from utils import get_logger
+
+log = get_logger("FIRESTORE")
+
+# Conversation writes are queued here and sent by one background thread, so the
+# voice loop never waits on a Firestore round trip. Order is preserved.
+_write_queue: "queue.Queue[tuple]" = queue.Queue(maxsize=1024)
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
 
 class FirestoreMemoryManager:
     """Manages persistent chat memory using Google Cloud Firestore."""
@@ -71,6 +83,14 @@ class FirestoreMemoryManager:
         """Get the number of messages in the current session."""
         return len(self.firestore_history.messages)
     
+    def save_message_in_background(self, role: str, text: str):
+        """Queue a 'user' or 'assistant' message for the background writer."""
+        _ensure_writer()
+        try:
+            _write_queue.put_nowait((self, role, text))
+        except queue.Full:
+            log.warning("Write queue full, dropping %s message", role)
+    
     def get_recent_messages(self, count: int = 10) -> list[BaseMessage]:
         """Get the most recent messages from the session."""
         messages = self.firestore_history.messages
@@ -106,6 +126,38 @@ class FirestoreMemoryManager:
             print(f"[FIRESTORE] Error getting conversation context: {e}")
             return "Error loading conversation context."
 
+def _ensure_writer():
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=_writer_loop, name="firestore-writer", daemon=True)
+            _writer_thread.start()
+
+def _writer_loop():
+    # Thread offload only: FirestoreChatMessageHistory keeps a session's whole
+    # history in one document and re-writes it on every add_message, so each
+    # queued message is still its own upsert. What this buys is that none of
+    # those round trips happen on the voice loop.
+    while True:
+        manager, role, text = _write_queue.get()
+        try:
+            message = HumanMessage(content=text) if role == "user" else AIMessage(content=text)
+            manager.firestore_history.add_message(message)
+            log.debug("Saved %s message to Firestore", role)
+        except Exception as e:
+            log.error("Error saving message: %s", e)
+        finally:
+            _write_queue.task_done()
+
+def flush_firestore_writes(timeout: float = 5.0) -> bool:
+    """Wait up to `timeout` seconds for queued conversation writes to land."""
+    deadline = time.monotonic() + timeout
+    while _write_queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
 # Global memory manager instance
 _firestore_memory_manager: Optional[FirestoreMemoryManager] = None
 
@@ -142,4 +194,6 @@ def get_firestore_memory() -> Optional[FirestoreMemoryManager]:
 def cleanup_firestore_memory():
     """Cleanup the global Firestore memory manager."""
     global _firestore_memory_manager
+    if not flush_firestore_writes():
+        log.warning("Timed out flushing queued messages on cleanup")
     _firestore_memory_manager = None
\ No newline at end of file
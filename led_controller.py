@@ -1,5 +1,6 @@
 # led_controller.py — self-healing version with DTR/RTS "replug" pulse
-import sys, time, threading, queue, glob
+import os, sys, time, threading, queue
+from concurrent.futures import ThreadPoolExecutor
 try:
     import serial
     from serial import SerialException
@@ -10,6 +11,7 @@ except ImportError:
 from config import CONFIG
 
 CTRL_D = b'\x04'  # soft reboot (Ctrl+D)
+_SERIAL_PREFIXES = ("ttyUSB", "ttyACM", "tty.usbmodem")
 ACK_OK, ACK_PONG = "OK", "PONG"
 
 
@@ -73,6 +75,9 @@ class LEDController:
         self._initialized = True
         self._ser = None
         self._reader = None
+        self._mode = None  # Last mode the Pico ACKed; None = unknown
+        # One worker keeps mode changes in order; the ACK wait (and any replug) runs there.
+        self._cmd_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="led")
         self._newline = b"\r\n" if CONFIG["pico"].get("newline", "LF").upper() == "CRLF" else b"\n"
         if SERIAL_AVAILABLE: self._connect()
         else: print("[LED_CTRL] pyserial missing.", file=sys.stderr)
@@ -83,14 +88,14 @@ class LEDController:
         if configured and "/dev/ttyUSB" in configured: return configured
         if configured and "/dev/ttyACM" in configured: return configured
         
-        # Look for common Raspberry Pi 5 USB serial devices
-        usb_devices = []
-        usb_devices.extend(glob.glob("/dev/ttyUSB*"))
-        usb_devices.extend(glob.glob("/dev/ttyACM*"))
-        usb_devices.extend(glob.glob("/dev/tty.usbmodem*"))
+        # Look for common Raspberry Pi 5 USB serial devices (one readdir of /dev)
+        try:
+            usb_devices = [e.path for e in os.scandir("/dev") if e.name.startswith(_SERIAL_PREFIXES)]
+        except OSError:
+            usb_devices = []
         
         if usb_devices:
-            return sorted(usb_devices)[0]
+            return min(usb_devices)
         
         # Fallback to configured port
         return configured
@@ -183,16 +188,40 @@ class LEDController:
         return False
 
     # ---------- Public API ----------
-    def turn_on(self):     return self._send_expect_ok("ON")
-    def turn_off(self):    return self._send_expect_ok("OFF")
-    def start_pulse(self): return self._send_expect_ok("PULSE_START")
-    def stop_pulse(self):  return self._send_expect_ok("PULSE_STOP")
+    _MODE_COMMANDS = {"on": "ON", "off": "OFF", "pulse": "PULSE_START"}
+
+    def set_mode(self, mode):
+        """Sends the command for `mode` unless the LEDs are already in it; waits for the ACK."""
+        return self._cmd_pool.submit(self._apply_mode, mode).result()
+
+    def post_mode(self, mode):
+        """Queues a mode change without waiting, for callers on the asyncio loop."""
+        self._cmd_pool.submit(self._apply_mode, mode)
+
+    def _apply_mode(self, mode):
+        if mode == self._mode:
+            return True
+        ok = self._send_expect_ok(self._MODE_COMMANDS[mode])
+        self._mode = mode if ok else None
+        return ok
+
+    def turn_on(self):     return self.set_mode("on")
+    def turn_off(self):    return self.set_mode("off")
+    def start_pulse(self): return self.set_mode("pulse")
+    def stop_pulse(self):  return self._cmd_pool.submit(self._apply_stop_pulse).result()
+
+    def _apply_stop_pulse(self):
+        self._mode = None
+        return self._send_expect_ok("PULSE_STOP")
     # --- FIX: Removed the unsupported flash_disconnect command ---
 
     def close(self):
         if self._ser and self._ser.is_open:
             try: self.turn_off(); time.sleep(0.05)
             except Exception: pass
+        # Let any queued command finish before the port goes away under it.
+        self._cmd_pool.shutdown(wait=True)
+        if self._ser and self._ser.is_open:
             try: self._reader.stop()
             except Exception: pass
             try: self._ser.close()
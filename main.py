@@ -1,6 +1,7 @@
 # main.py
 # Main entry point for the Eidoid Pet Robot.
 
+import argparse
 import asyncio
 import time
 import os
@@ -17,6 +18,14 @@ from session_manager import gemini_live_session
 from led_controller import led_controller
 # --- NEW: Import Firestore memory management ---
 from firestore_memory import initialize_firestore_memory, cleanup_firestore_memory
+from utils import enable_realtime_scheduling
+
+# uvloop is optional: a libuv-backed loop for the Live session when it's installed.
+try:
+    import uvloop
+    _session_loop_factory = uvloop.new_event_loop
+except ImportError:
+    _session_loop_factory = None
 
 
 def main():
@@ -43,7 +52,8 @@ def main():
                 led_controller.start_pulse()
                 # The state was changed by the wake word listener.
                 # Now, we run the main Gemini Live session.
-                asyncio.run(gemini_live_session())
+                with asyncio.Runner(loop_factory=_session_loop_factory) as runner:
+                    runner.run(gemini_live_session())
 
                 # --- MODIFIED: Added more explicit logging and re-ordered state reset ---
                 # This is the requested fix to ensure a clean return to the sleep loop.
@@ -75,6 +85,12 @@ def main():
         print("[MAIN] Cleanup complete. Exiting.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eidoid Pet Robot")
+    parser.add_argument("--rt", action="store_true",
+                        help="Pin PortAudio's callback threads (the Live session's mic and speaker) to their "
+                             "own core with SCHED_FIFO (needs CAP_SYS_NICE).")
+    args = parser.parse_args()
+
     # Ensure the API key is set before starting.
     if not os.getenv("GOOGLE_API_KEY"):
         print("[ERROR] GOOGLE_API_KEY environment variable not set.")
@@ -86,6 +102,9 @@ if __name__ == "__main__":
         print("Please set it to the path of your service account key JSON file.")
         sys.exit(1)
     
+    if args.rt:
+        enable_realtime_scheduling()
+
     # Start the robot.
     main()
 
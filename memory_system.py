@@ -10,9 +10,14 @@ from typing import Dict, List, Tuple, Any, Optional
 from collections import defaultdict, deque
 import hashlib
 import re
+import threading
 from dataclasses import dataclass, asdict, field
 from enum import Enum
 
+from utils import get_logger
+
+log = get_logger("MEMORY")
+
 # Memory storage directory
 MEMORY_DIR = os.path.join(os.path.dirname(__file__), "persona_memories")
 os.makedirs(MEMORY_DIR, exist_ok=True)
@@ -111,6 +116,15 @@ class PersonaMemory:
         self.session_start = time.time()
         self.interaction_count = 0
         
+        # Serializes writers; snapshots carry a sequence number so a slow
+        # background write can't overwrite a newer one.
+        self._save_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._written_seq = 0
+        # Memories extracted from speech are written in coalesced batches; this is
+        # when the oldest unsaved one was stored (None = nothing pending).
+        self._dirty_since = None
+        
         # Load existing memories
         self.load_memories()
         
@@ -154,6 +168,11 @@ class PersonaMemory:
         if role == "user":
             self._extract_memories_from_utterance(content)
     
+    def flush_if_stale(self, max_age: float = 5.0):
+        """Writes pending memories in the background once they've waited `max_age` seconds."""
+        if self._dirty_since is not None and time.monotonic() - self._dirty_since >= max_age:
+            self.save_memories_in_background()
+    
     def _extract_memories_from_utterance(self, utterance: str):
         """Extract potential memories from user utterance."""
         utterance_lower = utterance.lower()
@@ -226,8 +245,11 @@ class PersonaMemory:
         for tag in memory.tags:
             self.memory_by_tag[tag].append(memory_id)
         
-        # Save to disk
-        self.save_memories()
+        # Saved later in one batch: by flush_if_stale (driven by a session timer),
+        # or at the latest when the session ends or the process exits. Callers that
+        # need the write now (the store_important_memory tool) save explicitly.
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
     
     def _update_personality_from_interaction(self, trait: str, delta: float):
         """Update personality trait based on interaction."""
@@ -361,8 +383,10 @@ class PersonaMemory:
         
         return "\n".join(parts)
     
-    def save_memories(self):
-        """Save memories to disk."""
+    def _snapshot(self) -> Tuple[int, Dict]:
+        """Copy the persistent state so it can be written without holding up the caller."""
+        self._snapshot_seq += 1
+        self._dirty_since = None  # Everything pending is in this snapshot
         data = {
             "persona_key": self.persona_key,
             "long_term_memory": {
@@ -374,9 +398,30 @@ class PersonaMemory:
             "interaction_count": self.interaction_count,
             "last_saved": time.time()
         }
-        
-        with open(self.memory_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        return self._snapshot_seq, data
+    
+    def _write_snapshot(self, seq: int, data: Dict):
+        """Write a snapshot atomically (tmp file + rename) so a crash can't corrupt it."""
+        with self._save_lock:
+            if seq < self._written_seq:
+                return
+            tmp_file = self.memory_file + ".tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_file, self.memory_file)
+            self._written_seq = seq
+    
+    def save_memories(self):
+        """Save memories to disk."""
+        self._write_snapshot(*self._snapshot())
+    
+    def save_memories_in_background(self) -> threading.Thread:
+        """Snapshot memories now and write them to disk on a worker thread."""
+        seq, data = self._snapshot()
+        worker = threading.Thread(target=self._write_snapshot, args=(seq, data),
+                                  name=f"save-{self.persona_key}-memory")
+        worker.start()
+        return worker
     
     def load_memories(self):
         """Load memories from disk."""
@@ -404,7 +449,7 @@ class PersonaMemory:
             self.interaction_count = data.get("interaction_count", 0)
             
         except Exception as e:
-            print(f"[MEMORY] Error loading memories for {self.persona_key}: {e}")
+            log.error(f"Error loading memories for {self.persona_key}: {e}")
     
     def forget_old_memories(self, days: int = 30):
         """Remove memories older than specified days (except critical ones)."""
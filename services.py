@@ -241,7 +241,7 @@ class WebSearcher:
                 except Exception:
                     page = wikipedia.page(title)
                     summary = wikipedia.summary(title, sentences=3)
-                results.append({"title": page.title, "snippet": summary, "url": page.url})
+                results.append({"title": page.title, "snippet": summary[:500], "url": page.url})
         except Exception:
             pass # Wikipedia search can be brittle, fail silently
 
@@ -391,6 +391,8 @@ def store_persona_memory(persona_key: str, content: str, memory_type: str, impor
     
     # Store the memory
     memory_mgr._store_memory(content, memory_type_enum, importance_enum, tags or [])
+    # An explicit "remember this" shouldn't wait for the batched conversation flush.
+    memory_mgr.save_memories_in_background()
     
     return {"status": "OK", "message": f"Memory stored successfully for {persona_key}"}
 
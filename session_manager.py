@@ -2,16 +2,21 @@
 # with the Gemini Live API.
 
 import asyncio
+import atexit
+import collections
+import operator
+import random
+import threading
 import time
-import sys
 
+import numpy as np
 import pyaudio
 from google.genai import types
 from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
 
 import state
-from config import (CONFIG, LIVE_MODEL, PERSONAS, KEEPALIVE_SECONDS,
-                    RECONNECT_BACKOFF_SECONDS, MAX_BACKOFF_SECONDS,
+from config import (CONFIG, LIVE_MODEL, PERSONAS, KEEPALIVE_SECONDS, MEMORY_FLUSH_SECONDS,
+                    RECONNECT_BACKOFF_SECONDS, MAX_BACKOFF_SECONDS, RECONNECT_DEADLINE_S,
                     SESSION_SHORT_LIFETIME_S, SESSION_INFINITE_RETRY, IDLE_SECONDS,
                     VOICE_CATALOG)
 from firestore_memory import get_firestore_memory
@@ -25,68 +30,372 @@ from services import (searcher, send_command_to_mcu,
                       BASE_SYSTEM_RULES, query_persona_memories, store_persona_memory,
                       analyze_persona_personality, memory_query_tool_decl,
                       memory_store_tool_decl, personality_analysis_tool_decl)
-from utils import says_shutdown
+from utils import says_shutdown, get_logger, audio_thread_snapshot, promote_audio_threads
+from silence_gate import SilenceGate
+from audio_devices import get_pyaudio, detect_usb_speaker, open_mic_stream
+
+log = get_logger("SESSION")
+fs_log = get_logger("FIRESTORE")
 
 # =========================
-# USB Audio Detection for Raspberry Pi 5
+# Live Config Building Blocks
 # =========================
-def _detect_usb_microphone():
-    """
-    Auto-detect USB microphone device index for Raspberry Pi 5.
-    Returns None if no USB microphone is found.
-    """
+# These only depend on constants, so build them once instead of on every connect.
+_TOOLS_BASE = (motor_tool_decl, shutdown_tool_decl, web_search_tool_decl, persona_switch_tool_decl)
+_MEMORY_TOOLS = (memory_query_tool_decl, memory_store_tool_decl, personality_analysis_tool_decl)
+_MEMORY_PERSONAS = frozenset({"jarvis", "alexa"})
+
+# Keyed by (concierge_waiting_for_description, persona_has_memory)
+_TOOL_VARIANTS = {
+    (False, False): list(_TOOLS_BASE),
+    (True, False):  list(_TOOLS_BASE + (character_creation_tool_decl,)),
+    (False, True):  list(_TOOLS_BASE + _MEMORY_TOOLS),
+    (True, True):   list(_TOOLS_BASE + (character_creation_tool_decl,) + _MEMORY_TOOLS),
+}
+
+def _speech_config(voice_name):
+    return {"voice_config": {"prebuilt_voice_config": {"voice_name": voice_name}}}
+
+_VOICE_CFG = {name: _speech_config(name) for name in VOICE_CATALOG}
+
+_BREVITY_GUARD = (
+    "Always keep answers to 1–2 sentences unless the user explicitly asks for more "
+    "(e.g., 'explain', 'details', 'teach me')."
+)
+_instruction_cache = {"key": None, "text": None}
+
+def compose_system_instruction():
+    # Reconnects usually find nothing changed, so reuse the last instruction
+    # until the persona, custom instructions or memory context move on.
+    key = (state.active_persona_key, state.session_custom_instructions, state.memory_version)
+    if _instruction_cache["key"] == key:
+        return _instruction_cache["text"]
+    persona = PERSONAS.get(state.active_persona_key, {"prompt": "", "voice": "Kore"})
+    extra = state.session_custom_instructions or ""
+    parts = []
+    if persona["prompt"]:
+        parts += [persona["prompt"], "\n\n"]
+    parts += [BASE_SYSTEM_RULES, "\n", _BREVITY_GUARD, "\n"]
+    if extra:
+        parts += ["\n", extra]
+    parts += ["\n\n", state.render_memory_recency()]
+    text = "".join(parts)
+    _instruction_cache["key"] = key
+    _instruction_cache["text"] = text
+    return text
+
+_config_cache = {"key": None, "config": None}
+
+def build_live_config():
+    # --- MODIFIED: Tool lists and voice configs are precomputed at import ---
+    # The character creation tool is added while the concierge waits for a description,
+    # and memory tools are only offered to Jarvis and Alexa.
+    system_instruction = compose_system_instruction()
+    key = (_instruction_cache["key"], state.active_voice_name,
+           bool(state.concierge_waiting_for_description))
+    # A plain server-side reconnect changes none of the inputs; hand back the same dict.
+    if _config_cache["key"] == key:
+        return _config_cache["config"]
+    all_tools = _TOOL_VARIANTS[(key[2], state.active_persona_key in _MEMORY_PERSONAS)]
+    voice = state.active_voice_name
+    speech_config = _VOICE_CFG.get(voice) or _speech_config(voice)
+
+    config = {
+        "system_instruction": system_instruction,
+        "response_modalities": ["AUDIO"],
+        "tools": all_tools,
+        "speech_config": speech_config,
+    }
+    _config_cache["key"] = key
+    _config_cache["config"] = config
+    return config
+
+# =========================
+# Per-Connection Coroutines
+# =========================
+# Defined once here rather than as closures rebuilt on every reconnect; the
+# session loop passes in the live session, the mic queue/gate and its
+# `activity` dict.
+class _SessionDone(Exception):
+    """Raised to leave a connection's TaskGroup once receive() is finished with."""
+
+def _touch(activity):
+    activity["seen"] = True
+    activity["since_keepalive"] = True
+
+_keepalive_warned = False
+
+async def _send_keepalive(session):
+    # A protocol-level PING keeps the socket warm without handing the model a text
+    # turn to parse. session._ws is SDK-private, so if it's gone (or has no ping())
+    # fall back to an empty audio Blob, which the model doesn't treat as a turn.
+    global _keepalive_warned
     try:
-        p = pyaudio.PyAudio()
-        info = p.get_host_api_info_by_index(0)
-        num_devices = info.get('deviceCount')
-        
-        for i in range(num_devices):
-            device_info = p.get_device_info_by_host_api_device_index(0, i)
-            device_name = device_info.get('name', '').lower()
-            
-            # Look for USB audio devices
-            if (device_info.get('maxInputChannels') > 0 and 
-                any(keyword in device_name for keyword in ['usb', 'audio', 'microphone', 'mic'])):
-                print(f"[SESSION] Found USB microphone: Device {i} - {device_info.get('name')}")
-                p.terminate()
-                return i
-        
-        print("[SESSION] No USB microphone found, using default device")
-        p.terminate()
-        return None
-        
+        ping = getattr(getattr(session, "_ws", None), "ping", None)
+        if ping is not None:
+            await ping()
+        else:
+            await session.send_realtime_input(audio=types.Blob.model_construct(data=b"", mime_type=_MIC_MIME))
     except Exception as e:
-        print(f"[SESSION] Error detecting USB microphone: {e}")
-        return None
+        # The receive loop notices a dead socket on its own; just say why once.
+        if not _keepalive_warned:
+            _keepalive_warned = True
+            log.warning(f"Keepalive failed: {e!r}")
+
+def _keepalive_tick(loop, session, activity):
+    # A self-re-arming TimerHandle rather than a sleeping task; live audio or server
+    # traffic since the last tick already keeps the socket warm.
+    if activity["since_keepalive"]:
+        activity["since_keepalive"] = False
+    elif activity["keepalive_ping"] is None or activity["keepalive_ping"].done():
+        # At most one ping in flight; a slow one isn't stacked up behind.
+        activity["keepalive_ping"] = asyncio.ensure_future(_send_keepalive(session))
+    activity["keepalive_timer"] = loop.call_later(KEEPALIVE_SECONDS, _keepalive_tick, loop, session, activity)
+
+def _memory_flush_tick(loop, activity):
+    # Memories extracted from the conversation are batched; this timer writes them
+    # once they've waited MEMORY_FLUSH_SECONDS, whether or not the user speaks again.
+    if state.current_memory_manager:
+        state.current_memory_manager.flush_if_stale(MEMORY_FLUSH_SECONDS)
+    activity["memory_timer"] = loop.call_later(MEMORY_FLUSH_SECONDS, _memory_flush_tick, loop, activity)
+
+_VAD_THRESHOLD = CONFIG["audio"]["vad_rms_threshold"]
+# rms < T  <=>  sum(x^2) < T^2 * n, so the per-chunk test needs no sqrt or divide.
+_VAD_THRESHOLD_SQ = float(_VAD_THRESHOLD) ** 2
+_VAD_HANGOVER = CONFIG["audio"]["vad_hangover_chunks"]
+
+# Reused float32 scratch for the gate; only the mic sender task ever touches it.
+_vad_scratch = np.empty(CONFIG["audio"]["chunk_size"] * CONFIG["audio"]["channels"], dtype=np.float32)
+
+def _chunk_is_quiet(chunk):
+    # One fused pass: the dot product squares and accumulates in a single BLAS call
+    # instead of materialising square() and then reducing it with mean().
+    pcm = np.frombuffer(chunk, dtype=np.int16)  # a view, no copy
+    if pcm.size <= _vad_scratch.size:
+        samples = _vad_scratch[:pcm.size]
+        np.copyto(samples, pcm, casting="unsafe")
+    else:
+        samples = pcm.astype(np.float32)
+    return np.dot(samples, samples) < _VAD_THRESHOLD_SQ * samples.size
+
+async def _send_audio(session, mic_q, mic_enabled, activity):
+    # Reads and sends in one coroutine; no async generator sits between the
+    # mic queue and the socket.
+    listening = state.RobotState.LISTENING
+    # Silence gate (see silence_gate.py): after a hangover of quiet chunks, stop
+    # uploading and tell the server the stream has ended so it doesn't sit waiting
+    # for more audio before deciding the user's turn is over; the next loud chunk
+    # reopens it with the last held chunk as pre-roll.
+    gate = SilenceGate(_VAD_HANGOVER)
+    try:
+        while state.current_state == listening:
+            await mic_enabled.wait()
+            chunk = await mic_q.get()
+            if not mic_enabled.is_set() or speaker_busy():
+                gate.drop_held()
+                continue
+            if not _VAD_THRESHOLD:
+                to_send = (chunk,)
+            else:
+                to_send, end_stream = gate.feed(chunk, _chunk_is_quiet(chunk))
+                if end_stream:
+                    await session.send_realtime_input(audio_stream_end=True)
+                if not to_send:
+                    continue
+            # PortAudio's callback buffer goes straight into the Blob, no copy. Blob is a
+            # pydantic model; both fields are known-good, so skip per-chunk validation.
+            for data in to_send:
+                await session.send_realtime_input(audio=types.Blob.model_construct(data=data, mime_type=_MIC_MIME))
+            _touch(activity)
+    except (ConnectionClosed, ConnectionClosedOK, asyncio.CancelledError):
+        pass
 
-def _detect_usb_speaker():
-    """
-    Auto-detect USB speaker device index for Raspberry Pi 5.
-    Returns None if no USB speaker is found.
-    """
+# =========================
+# Tool Call Handlers
+# =========================
+# Each handler takes the call's args and a `change` dict it can fill with
+# close_reason / persona_key / voice; the session loop applies it afterwards.
+# Anything that can touch the network or the serial port runs in a worker thread
+# so the receive loop keeps pumping audio meanwhile. The persona memory tools stay
+# on the loop: PersonaMemory's dicts are only ever touched from this thread, and
+# its disk writes already go to a worker via save_memories_in_background().
+_OK = {"status": "OK"}
+_ERR = {"status": "ERROR"}
+_CHAR_FIELDS = ("name", "world", "personality", "voice")
+_CHAR_FIELD_DEFAULTS = dict.fromkeys(_CHAR_FIELDS)
+_save_char_fields = operator.itemgetter(*_CHAR_FIELDS)
+
+async def _tool_motor_command(args, change):
+    await asyncio.to_thread(send_command_to_mcu, args)
+    return _OK
+
+async def _tool_shutdown_robot(args, change):
+    log.info("'shutdown_robot' tool called.")
+    # --- NEW: Turn off LEDs immediately when shutdown is called ---
+    led_controller.post_mode("off")
+    state.set_state(state.RobotState.SLEEPING)
+    change["close_reason"] = "shutdown_to_sleep"
+    return _OK
+
+async def _tool_web_search(args, change):
+    return await asyncio.to_thread(searcher.search, args.get("query"), args.get("max_results"))
+
+# --- NEW: Handle the character creation tool call ---
+async def _tool_save_character_profile(args, change):
+    log.info("'save_character_profile' tool called.")
+    char_name, char_world, char_personality, char_voice = _save_char_fields({**_CHAR_FIELD_DEFAULTS, **args})
+
+    if char_name and char_world and char_personality and char_voice in VOICE_CATALOG:
+        custom_instr = build_character_persona_instructions(
+            name=char_name,
+            world=char_world,
+            personality=char_personality
+        )
+        # Set up the state for the *next* session
+        state.set_session_state(is_concierge_waiting=False, custom_instructions=custom_instr)
+        change.update(close_reason="persona_switch", voice=char_voice,
+                      persona_key=blank_key_for_voice(char_voice))
+        return _OK
+    return {"status": "ERROR", "message": "Missing required character profile fields."}
+
+async def _tool_persona_switch(args, change):
+    pk = args.get("persona_key"); vn = args.get("voice_name"); ci = args.get("custom_instructions")
+    if pk and pk in PERSONAS:
+        change.update(close_reason="persona_switch", persona_key=pk, voice=PERSONAS[pk]["voice"])
+    elif vn and vn in VOICE_CATALOG:
+        change.update(close_reason="persona_switch", persona_key=blank_key_for_voice(vn), voice=vn)
+    else:
+        return _ERR
+    state.session_custom_instructions = ci
+    return _OK
+
+async def _tool_query_memories(args, change):
+    return query_persona_memories(state.active_persona_key, args.get("query", ""),
+                                  args.get("memory_type", "all"), args.get("max_results", 5))
+
+async def _tool_store_important_memory(args, change):
+    content = args.get("content")
+    memory_type = args.get("memory_type")
+    importance = args.get("importance")
+    if content and memory_type and importance:
+        result = store_persona_memory(state.active_persona_key, content,
+                                      memory_type, importance, args.get("tags", []))
+        state.invalidate_memory_recency()
+        return result
+    return {"status": "ERROR", "message": "Missing required parameters"}
+
+async def _tool_analyze_personality_development(args, change):
+    return analyze_persona_personality(state.active_persona_key, args.get("include_history", False))
+
+async def _unknown_tool(args, change):
+    return {"status": "ERROR", "message": "Unknown tool"}
+
+TOOL_HANDLERS = {
+    "motor_command": _tool_motor_command,
+    "shutdown_robot": _tool_shutdown_robot,
+    "web_search": _tool_web_search,
+    "save_character_profile": _tool_save_character_profile,
+    "persona_switch": _tool_persona_switch,
+    "query_memories": _tool_query_memories,
+    "store_important_memory": _tool_store_important_memory,
+    "analyze_personality_development": _tool_analyze_personality_development,
+}
+
+async def _dispatch_tool(fc, change):
+    handler = TOOL_HANDLERS.get(fc.name, _unknown_tool)
     try:
-        p = pyaudio.PyAudio()
-        info = p.get_host_api_info_by_index(0)
-        num_devices = info.get('deviceCount')
-        
-        for i in range(num_devices):
-            device_info = p.get_device_info_by_host_api_device_index(0, i)
-            device_name = device_info.get('name', '').lower()
-            
-            # Look for USB audio devices
-            if (device_info.get('maxOutputChannels') > 0 and 
-                any(keyword in device_name for keyword in ['usb', 'audio', 'speaker', 'headphone'])):
-                print(f"[SESSION] Found USB speaker: Device {i} - {device_info.get('name')}")
-                p.terminate()
-                return i
-        
-        print("[SESSION] No USB speaker found, using default device")
-        p.terminate()
-        return None
-        
+        result = await handler(fc.args or {}, change)
     except Exception as e:
-        print(f"[SESSION] Error detecting USB speaker: {e}")
-        return None
+        # One failing tool shouldn't take the whole connection down with it.
+        log.error(f"Tool '{fc.name}' failed: {e}")
+        result = {"status": "ERROR", "message": str(e)}
+    # id/name come straight from the server's FunctionCall and result is always a
+    # dict, so pydantic validation of a possibly large search payload is skipped.
+    return types.FunctionResponse.model_construct(id=fc.id, name=fc.name, response=result)
+
+# =========================
+# Persistent Audio Handles
+# =========================
+# PortAudio/ALSA init costs hundreds of ms, so the speaker stream (on the shared
+# PyAudio instance from audio_devices) is created once and reused by every
+# gemini_live_session() call. The mic stream is still opened per session: the wake
+# word listener needs the same capture device while the robot is asleep, and a
+# stopped PortAudio stream keeps it claimed.
+_spk_lock = threading.Lock()
+_spk_stream = None
+
+# Speaker jitter ring: the receive loop appends Gemini's audio chunks and the
+# PortAudio output callback drains them at DAC cadence, padding underruns with
+# silence. deque append/popleft are atomic, so no lock is needed between them.
+_SPK_FRAME_BYTES = 2 * CONFIG["audio"]["channels"]  # paInt16
+# Ring entries are coalesced into 100 ms blocks so tiny Gemini frames don't each
+# cost a deque slot and a trip through the callback's refill loop. That also
+# makes maxlen a duration cap: past playback_max_seconds the oldest audio goes.
+_SPK_BLOCK_BYTES = CONFIG["audio"]["speaker_rate"] * _SPK_FRAME_BYTES // 10
+_spk_ring = collections.deque(maxlen=int(CONFIG["audio"]["playback_max_seconds"] * 10))
+_spk_tail = bytearray()
+_MIC_MIME = f"audio/pcm;rate={CONFIG['audio']['rate']}"
+
+# Silence is immutable, so one zero buffer per period size serves every underrun.
+_silence = {}
+
+def _zeros(n):
+    buf = _silence.get(n)
+    if buf is None:
+        buf = _silence[n] = bytes(n)
+    return buf
+
+def _on_spk(in_data, frame_count, time_info, status):
+    need = frame_count * _SPK_FRAME_BYTES
+    while len(_spk_tail) < need and _spk_ring:
+        _spk_tail.extend(_spk_ring.popleft())
+    if not _spk_tail:
+        return (_zeros(need), pyaudio.paContinue)
+    # Copy out through a view so the slice isn't materialised as a bytearray first.
+    with memoryview(_spk_tail) as view:
+        out = bytes(view[:need])
+    del _spk_tail[:need]
+    if len(out) < need:
+        out += _zeros(need - len(out))
+    return (out, pyaudio.paContinue)
+
+def speaker_busy():
+    """True while queued assistant audio has not yet been handed to PortAudio."""
+    return bool(_spk_ring or _spk_tail)
+
+def get_spk_stream():
+    """Returns the shared speaker stream, opening it on first use."""
+    global _spk_stream
+    p = get_pyaudio()
+    with _spk_lock:
+        if _spk_stream is None:
+            threads_before_open = audio_thread_snapshot()
+            _spk_stream = p.open(format=pyaudio.paInt16, channels=CONFIG["audio"]["channels"],
+                                 rate=CONFIG["audio"]["speaker_rate"], output=True,
+                                 frames_per_buffer=CONFIG["audio"]["chunk_size"],
+                                 output_device_index=detect_usb_speaker(),
+                                 stream_callback=_on_spk)
+            # With --rt, give PortAudio's threads their own core and FIFO priority
+            promote_audio_threads(threads_before_open)
+        elif _spk_stream.is_stopped():
+            _spk_stream.start_stream()
+        return _spk_stream
+
+def _close_spk_stream():
+    global _spk_stream
+    with _spk_lock:
+        if _spk_stream is not None:
+            try:
+                _spk_stream.close()
+            except Exception:
+                pass
+            _spk_stream = None
+
+# Runs before audio_devices terminates PortAudio (atexit is last in, first out).
+atexit.register(_close_spk_stream)
+
+# LangChain message types mapped onto the conversation buffer's roles
+_HISTORY_ROLES = {"human": "user", "ai": "assistant"}
 
 # =========================
 # Gemini Live Session Main Function
@@ -97,286 +406,334 @@ async def gemini_live_session():
     This function will loop internally, trying to maintain a connection, and will
     only exit fully upon an explicit shutdown command or idle timeout.
     """
-    state.set_state(state.RobotState.LISTENING)
+    # RobotState members are plain ints; bind the one the hot loops compare against.
+    LISTENING = state.RobotState.LISTENING
+    state.set_state(LISTENING)
     
     # --- NEW: Load conversation history from Firestore ---
+    # The network round trip runs on a worker thread while the audio streams open;
+    # the result is applied to state (on the loop) before the first connect. Only the
+    # first wake of each persona pays for it; later wakes skip the round trip.
     firestore_memory = get_firestore_memory()
-    if firestore_memory:
+    history_task = None
+    hydrating_persona = state.active_persona_key
+    if not firestore_memory:
+        fs_log.info("No Firestore memory available")
+    elif hydrating_persona not in state.history_hydrated:
+        history_task = asyncio.create_task(asyncio.to_thread(firestore_memory.get_recent_messages, count=20))
+
+    # !!! IMPORTANT !!!
+    # USB audio devices for Raspberry Pi 5 are auto-detected when the streams open.
+    # Run list_audio_devices.py to find the correct device indices
+    # --- MODIFIED: Speaker and PyAudio persist across sessions; only the mic is per-session ---
+    loop = asyncio.get_running_loop()
+
+    # --- NEW: PortAudio pushes mic chunks from its own thread instead of a to_thread read per chunk ---
+    # Bounded to two chunks so nothing stale is waiting when the mic reopens.
+    mic_q = asyncio.Queue(maxsize=2)
+    # Cleared while the assistant speaks. is_set() is a plain read, safe from the audio thread.
+    mic_enabled = asyncio.Event()
+    mic_enabled.set()
+
+    def put_mic_chunk(chunk):
+        try:
+            mic_q.put_nowait(chunk)
+        except asyncio.QueueFull:
+            pass  # Consumer is behind (e.g. reconnecting); newest audio is dropped.
+
+    def drain_mic():
+        while not mic_q.empty():
+            mic_q.get_nowait()
+
+    def on_mic(in_data, frame_count, time_info, status):
+        # Muted while the assistant speaks: drop in the audio thread, never enqueue.
+        if mic_enabled.is_set():
+            loop.call_soon_threadsafe(put_mic_chunk, in_data)
+        return (None, pyaudio.paContinue)
+
+    mic_stream = open_mic_stream(on_mic)
+    get_spk_stream()  # Starts the speaker callback if this is the first session
+
+    if history_task:
         try:
             # Load recent messages from Firestore into the conversation buffer
-            recent_messages = firestore_memory.get_recent_messages(count=20)
-            print(f"[FIRESTORE] Loaded {len(recent_messages)} messages from Firestore")
+            recent_messages = await history_task
+            fs_log.info(f"Loaded {len(recent_messages)} messages from Firestore")
             
-            # Add messages to the conversation buffer for context
-            for message in recent_messages:
-                if hasattr(message, 'content'):
-                    if hasattr(message, 'type'):
-                        if message.type == 'human':
-                            state.add_user_utt(message.content)
-                        elif message.type == 'ai':
-                            state.add_assistant_utt(message.content)
-                    else:
-                        # Fallback: assume alternating user/assistant based on position
-                        pass  # We'll let the normal flow handle this
+            # Add messages to the conversation buffer for context. They already live in
+            # Firestore, so they are bulk-loaded rather than re-saved one by one.
+            state.load_utterances(
+                (_HISTORY_ROLES[message.type], message.content)
+                for message in recent_messages
+                if getattr(message, 'type', None) in _HISTORY_ROLES and isinstance(message.content, str)
+            )
+            state.history_hydrated.add(hydrating_persona)
         except Exception as e:
-            print(f"[FIRESTORE] Error loading conversation history: {e}")
-    else:
-        print("[FIRESTORE] No Firestore memory available")
-
-    # !!! IMPORTANT !!!
-    # Auto-detect USB audio devices for Raspberry Pi 5
-    # Run list_audio_devices.py to find the correct device indices
-    MIC_DEVICE_INDEX = _detect_usb_microphone()
-    SPEAKER_DEVICE_INDEX = _detect_usb_speaker()
-
-    p = pyaudio.PyAudio()
-
-    # --- MODIFIED: Added input_device_index ---
-    mic_stream = p.open(format=CONFIG["audio"]["format"], channels=CONFIG["audio"]["channels"],
-                        rate=CONFIG["audio"]["rate"], input=True,
-                        frames_per_buffer=CONFIG["audio"]["chunk_size"],
-                        input_device_index=MIC_DEVICE_INDEX)
-                        
-    # --- MODIFIED: Added output_device_index ---
-    spk_stream = p.open(format=pyaudio.paInt16, channels=CONFIG["audio"]["channels"],
-                        rate=CONFIG["audio"]["speaker_rate"], output=True,
-                        frames_per_buffer=CONFIG["audio"]["chunk_size"],
-                        output_device_index=SPEAKER_DEVICE_INDEX)
+            fs_log.error(f"Error loading conversation history: {e}")
 
     reconnect_attempt = 0
     backoff = RECONNECT_BACKOFF_SECONDS
-
-    while state.current_state == state.RobotState.LISTENING:
-        mic_enabled_flag = {"on": True}
-        send_task = None
-        keepalive_task = None
+    outage_started = None  # Set on the first failed/short connection of a streak
+
+    # --- NEW: Playback is pulled by the speaker callback so a slow DAC can't stall receive() ---
+    # The ring outlives reconnects so a turn's audio isn't cut when the socket cycles.
+    playback = {"last_drop_warn": 0.0, "pending": bytearray()}
+
+    def push_block(block):
+        # QoS gate: once the ring is full, appending evicts the oldest chunk
+        # rather than letting latency build up behind the device.
+        if len(_spk_ring) == _spk_ring.maxlen:
+            state.playback_q_watermark += 1
+            now = time.monotonic()
+            if now - playback["last_drop_warn"] > 60.0:
+                playback["last_drop_warn"] = now
+                log.warning(f"Playback queue saturated; dropping audio frames "
+                            f"(total dropped: {state.playback_q_watermark})")
+        _spk_ring.append(block)
+
+    def enqueue_playback(data):
+        pending = playback["pending"]
+        pending.extend(data)
+        while len(pending) >= _SPK_BLOCK_BYTES:
+            push_block(bytes(pending[:_SPK_BLOCK_BYTES]))
+            del pending[:_SPK_BLOCK_BYTES]
+
+    def flush_playback():
+        # Hands the last partial block to the speaker at the end of a turn.
+        pending = playback["pending"]
+        if pending:
+            push_block(bytes(pending))
+            pending.clear()
+
+    # Transcription arrives in fragments; buffer them and record one utterance
+    # per turn so the memory store and Firestore see one write instead of many.
+    user_parts = []
+    asst_parts = []
+
+    def flush_user_transcript():
+        text = "".join(user_parts).strip()
+        user_parts.clear()
+        if text: state.add_user_utt(text)
+
+    def flush_transcripts():
+        flush_user_transcript()
+        text = "".join(asst_parts).strip()
+        asst_parts.clear()
+        if text: state.add_assistant_utt(text)
+
+    # Speaking <-> listening transitions. The LED goes back to pulsing only after a
+    # short hold-off, so a text-only message in the middle of a reply doesn't make
+    # it flicker; the controller also skips commands for the mode it's already in,
+    # and post_mode() keeps the serial ACK wait off the event loop.
+    # Audio is received faster than it plays, so the hold-off is re-armed until the
+    # speaker ring has drained; the LED follows playback, not the socket.
+    led_pulse = {"timer": None}
+
+    def pulse_when_drained():
+        if speaker_busy():
+            led_pulse["timer"] = loop.call_later(0.1, pulse_when_drained)
+        else:
+            led_pulse["timer"] = None
+            led_controller.post_mode("pulse")
+
+    def cancel_led_pulse():
+        if led_pulse["timer"]:
+            led_pulse["timer"].cancel()
+            led_pulse["timer"] = None
+
+    def enter_speaking():
+        mic_enabled.clear()
+        drain_mic()
+        cancel_led_pulse()
+        # --- NEW: Turn on solid LEDs when assistant is speaking ---
+        led_controller.post_mode("on")
+
+    def exit_speaking():
+        flush_playback()
+        mic_enabled.set()
+        cancel_led_pulse()
+        # --- NEW: Return to pulsing LEDs when assistant stops speaking ---
+        led_pulse["timer"] = loop.call_later(0.1, pulse_when_drained)
+
+    # Per-connection bookkeeping shared with the module-level helpers below. `seen` is
+    # set by _touch(); the idle timer clears it on every tick instead of reading the
+    # clock for each message.
+    activity = {}
+
+    def on_idle_tick(session):
+        # A single TimerHandle re-arms itself every quarter of IDLE_SECONDS;
+        # four quiet ticks in a row means the session has gone idle.
+        if activity["seen"]:
+            activity["seen"] = False
+            activity["quiet_ticks"] = 0
+        else:
+            activity["quiet_ticks"] += 1
+            if activity["quiet_ticks"] >= 4:
+                activity["close_reason"] = "idle_timeout"
+                activity["idle_timer"] = None
+                # Kept so teardown can wait for the close instead of leaving it dangling.
+                activity["closing"] = asyncio.ensure_future(session.close())
+                return
+        activity["idle_timer"] = loop.call_later(IDLE_SECONDS / 4, on_idle_tick, session)
+
+    while state.current_state == LISTENING:
+        mic_enabled.set()
         close_reason = None
         start_of_session = time.monotonic()
-        last_activity = start_of_session
+        activity.update(seen=True, quiet_ticks=0, since_keepalive=True,
+                        idle_timer=None, keepalive_timer=None, keepalive_ping=None,
+                        memory_timer=None, closing=None, close_reason=None)
 
         pending_voice = state.active_voice_name
         pending_persona_key = state.active_persona_key
 
-        def touch():
-            nonlocal last_activity
-            last_activity = time.monotonic()
-
-        def compose_system_instruction():
-            persona = PERSONAS.get(state.active_persona_key, {"prompt": "", "voice": "Kore"})
-            extra = state.session_custom_instructions or ""
-            memory = state.render_memory_recency()
-            brevity_guard = (
-                "Always keep answers to 1–2 sentences unless the user explicitly asks for more "
-                "(e.g., 'explain', 'details', 'teach me')."
-            )
-            return (
-                (persona["prompt"] + "\n\n" if persona["prompt"] else "") +
-                BASE_SYSTEM_RULES + "\n" + brevity_guard + "\n" +
-                (("\n" + extra) if extra else "") +
-                "\n\n" + memory
-            )
-
-        def build_live_config():
-            # --- MODIFIED: Add the new character creation tool to the list ---
-            all_tools = [motor_tool_decl, shutdown_tool_decl, web_search_tool_decl, persona_switch_tool_decl]
-            if state.concierge_waiting_for_description:
-                 all_tools.append(character_creation_tool_decl)
-            
-            # Add memory tools for Jarvis and Alexa personas
-            if state.active_persona_key in ["jarvis", "alexa"]:
-                all_tools.extend([memory_query_tool_decl, memory_store_tool_decl, personality_analysis_tool_decl])
-
-            return {
-                "system_instruction": compose_system_instruction(),
-                "response_modalities": ["AUDIO"],
-                "tools": all_tools,
-                "speech_config": {"voice_config": {"prebuilt_voice_config": {"voice_name": state.active_voice_name}}},
-            }
-        
         # --- NEW: Updated model ID based on Oct 2025 documentation ---
         live_model_id = LIVE_MODEL
 
         try:
-            print(f"[SESSION] Starting Gemini Live with model {live_model_id}...")
+            log.info(f"Starting Gemini Live with model {live_model_id}...")
             async with client.aio.live.connect(model=live_model_id, config=build_live_config()) as session:
                 reconnect_attempt = 0
                 backoff = RECONNECT_BACKOFF_SECONDS
-                print("[SESSION] Connected")
-                touch()
+                log.info("Connected")
+                _touch(activity)
+                activity["idle_timer"] = loop.call_later(IDLE_SECONDS / 4, on_idle_tick, session)
+                activity["keepalive_timer"] = loop.call_later(KEEPALIVE_SECONDS, _keepalive_tick, loop, session, activity)
+                activity["memory_timer"] = loop.call_later(MEMORY_FLUSH_SECONDS, _memory_flush_tick, loop, activity)
 
                 if state.startup_hint:
                     await session.send_realtime_input(text=state.startup_hint)
                     state.set_session_state(hint=None, is_concierge_waiting=state.concierge_waiting_for_description)
 
-                async def keepalive():
-                    while True:
-                        await asyncio.sleep(KEEPALIVE_SECONDS)
-                        try:
-                            await session.send_realtime_input(text="[[keepalive]]")
-                        except Exception:
-                            break
-                keepalive_task = asyncio.create_task(keepalive())
-
-                async def mic_gen():
-                    while state.current_state == state.RobotState.LISTENING:
-                        chunk = await asyncio.to_thread(mic_stream.read, CONFIG["audio"]["chunk_size"], False)
-                        if mic_enabled_flag["on"]:
-                            yield types.Blob(data=chunk, mime_type="audio/pcm;rate=16000")
-                            touch()
-                        else:
-                            await asyncio.sleep(0.02)
-
-                async def send_audio():
-                    try:
-                        async for blob in mic_gen():
-                            await session.send_realtime_input(audio=blob)
-                    except (ConnectionClosed, ConnectionClosedOK, asyncio.CancelledError):
-                        pass
-                send_task = asyncio.create_task(send_audio())
-
-                is_speaking = False
+                # Siblings live in a TaskGroup: leaving the block (normally or via
+                # _SessionDone) cancels them and waits until they have actually exited.
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(_send_audio(session, mic_q, mic_enabled, activity))
+
+                        is_speaking = False
                 
-                async for msg in session.receive():
-                    touch()
-                    if getattr(msg, "go_away", None):
-                        close_reason = "go_away"; break
-
-                    played = False
-                    if hasattr(msg, "data") and isinstance(getattr(msg, "data"), (bytes, bytearray)):
-                        if not is_speaking: 
-                            is_speaking = True; 
-                            mic_enabled_flag["on"] = False
-                            # --- NEW: Turn on solid LEDs when assistant is speaking ---
-                            led_controller.turn_on()
-                        spk_stream.write(msg.data); played = True
-
-                    sc = getattr(msg, "server_content", None)
-                    if sc:
-                        in_tr = getattr(sc, "input_transcription", None)
-                        if in_tr and getattr(in_tr, "text", None):
-                            txt = (in_tr.text or "").strip()
-                            if txt:
-                                state.add_user_utt(txt)
-                                if says_shutdown(txt):
-                                    print("[SESSION] Shutdown phrase detected in transcription.")
-                                    # --- NEW: Turn off LEDs when shutdown phrase is detected ---
-                                    led_controller.turn_off()
-                                    state.set_state(state.RobotState.SLEEPING)
-                                    close_reason = "shutdown_to_sleep"
-                                # --- REMOVED: Old logic for concierge text parsing is now replaced by the tool call below ---
-
-                        out_tr = getattr(sc, "output_transcription", None)
-                        if out_tr and getattr(out_tr, "text", None):
-                            txt = (out_tr.text or "").strip()
-                            if txt: state.add_assistant_utt(txt)
-
-                    if is_speaking and not played:
-                        is_speaking = False; 
-                        mic_enabled_flag["on"] = True
-                        # --- NEW: Return to pulsing LEDs when assistant stops speaking ---
-                        led_controller.start_pulse()
-
-                    if (time.monotonic() - last_activity) > IDLE_SECONDS:
-                        close_reason = "idle_timeout"; break
-
-                    if getattr(msg, "tool_call", None) and getattr(msg.tool_call, "function_calls", None):
-                        responses = []
-                        for fc in msg.tool_call.function_calls:
-                            name = fc.name; args = fc.args or {}; fid = fc.id
-                            if name == "motor_command":
-                                send_command_to_mcu(args)
-                                responses.append(types.FunctionResponse(id=fid, name=name, response={"status":"OK"}))
-                            elif name == "shutdown_robot":
-                                print("[SESSION] 'shutdown_robot' tool called.")
-                                # --- NEW: Turn off LEDs immediately when shutdown is called ---
-                                led_controller.turn_off()
-                                state.set_state(state.RobotState.SLEEPING)
-                                close_reason = "shutdown_to_sleep"
-                                responses.append(types.FunctionResponse(id=fid, name=name, response={"status":"OK"}))
-                            elif name == "web_search":
-                                data = searcher.search(args.get("query"), args.get("max_results"))
-                                responses.append(types.FunctionResponse(id=fid, name=name, response=data))
-                            # --- NEW: Handle the character creation tool call ---
-                            elif name == "save_character_profile":
-                                print("[SESSION] 'save_character_profile' tool called.")
-                                char_name = args.get("name")
-                                char_world = args.get("world")
-                                char_personality = args.get("personality")
-                                char_voice = args.get("voice")
-
-                                if char_name and char_world and char_personality and char_voice in VOICE_CATALOG:
-                                    custom_instr = build_character_persona_instructions(
-                                        name=char_name,
-                                        world=char_world,
-                                        personality=char_personality
-                                    )
-                                    # Set up the state for the *next* session
-                                    state.set_session_state(is_concierge_waiting=False, custom_instructions=custom_instr)
-                                    pending_voice = char_voice
-                                    pending_persona_key = blank_key_for_voice(char_voice)
-                                    close_reason = "persona_switch"
-                                    responses.append(types.FunctionResponse(id=fid, name=name, response={"status": "OK"}))
-                                else:
-                                    responses.append(types.FunctionResponse(id=fid, name=name, response={"status": "ERROR", "message": "Missing required character profile fields."}))
-
-                            elif name == "persona_switch":
-                                pk = args.get("persona_key"); vn = args.get("voice_name"); ci = args.get("custom_instructions")
-                                if pk and pk in PERSONAS:
-                                    pending_persona_key = pk; pending_voice = PERSONAS[pk]["voice"]; state.session_custom_instructions = ci
-                                    close_reason="persona_switch"
-                                    responses.append(types.FunctionResponse(id=fid,name=name,response={"status":"OK"}))
-                                elif vn and vn in VOICE_CATALOG:
-                                    pending_voice = vn; pending_persona_key = blank_key_for_voice(vn); state.session_custom_instructions = ci
-                                    close_reason="persona_switch"
-                                    responses.append(types.FunctionResponse(id=fid, name=name, response={"status":"OK"}))
-                                else:
-                                    responses.append(types.FunctionResponse(id=fid,name=name,response={"status":"ERROR"}))
-                            elif name == "query_memories":
-                                query = args.get("query", "")
-                                memory_type = args.get("memory_type", "all")
-                                max_results = args.get("max_results", 5)
-                                result = query_persona_memories(state.active_persona_key, query, memory_type, max_results)
-                                responses.append(types.FunctionResponse(id=fid, name=name, response=result))
-                            elif name == "store_important_memory":
-                                content = args.get("content")
-                                memory_type = args.get("memory_type")
-                                importance = args.get("importance")
-                                tags = args.get("tags", [])
-                                if content and memory_type and importance:
-                                    result = store_persona_memory(state.active_persona_key, content, memory_type, importance, tags)
-                                    responses.append(types.FunctionResponse(id=fid, name=name, response=result))
-                                else:
-                                    responses.append(types.FunctionResponse(id=fid, name=name, response={"status": "ERROR", "message": "Missing required parameters"}))
-                            elif name == "analyze_personality_development":
-                                include_history = args.get("include_history", False)
-                                result = analyze_persona_personality(state.active_persona_key, include_history)
-                                responses.append(types.FunctionResponse(id=fid, name=name, response=result))
-                        if responses: await session.send_tool_response(function_responses=responses)
-
-                    if close_reason: break
-                if not close_reason: close_reason = "server_closed"
-
-        except (ConnectionClosed, ConnectionClosedOK): close_reason = "server_closed"
-        except Exception as e: close_reason = f"error: {e}"
+                        async for msg in session.receive():
+                            _touch(activity)
+                            # LiveServerMessage is a pydantic model: every field exists and
+                            # defaults to None, so plain attribute reads replace getattr probes.
+                            if msg.go_away:
+                                close_reason = "go_away"; break
+
+                            played = False
+                            # msg.data is a property that joins the inline audio parts, so read it once.
+                            data = msg.data
+                            if data:
+                                if not is_speaking: 
+                                    is_speaking = True
+                                    enter_speaking()
+                                enqueue_playback(data); played = True
+
+                            sc = msg.server_content
+                            if sc:
+                                in_tr = sc.input_transcription
+                                if in_tr and in_tr.text:
+                                    user_parts.append(in_tr.text)
+                                    if says_shutdown(in_tr.text):
+                                        log.info("Shutdown phrase detected in transcription.")
+                                        # --- NEW: Turn off LEDs when shutdown phrase is detected ---
+                                        led_controller.post_mode("off")
+                                        state.set_state(state.RobotState.SLEEPING)
+                                        close_reason = "shutdown_to_sleep"
+                                    # --- REMOVED: Old logic for concierge text parsing is now replaced by the tool call below ---
+
+                                out_tr = sc.output_transcription
+                                if out_tr and out_tr.text:
+                                    # The user's turn is over once the reply starts; keep the order.
+                                    if user_parts: flush_user_transcript()
+                                    asst_parts.append(out_tr.text)
+
+                                if sc.turn_complete or sc.interrupted:
+                                    flush_transcripts()
+
+                            if is_speaking and not played:
+                                is_speaking = False
+                                exit_speaking()
+
+                            tc = msg.tool_call
+                            if tc and tc.function_calls:
+                                # Independent calls in one message run concurrently (order is kept).
+                                change = {}
+                                responses = await asyncio.gather(*(_dispatch_tool(fc, change) for fc in tc.function_calls))
+                                if change:
+                                    close_reason = change.get("close_reason", close_reason)
+                                    pending_persona_key = change.get("persona_key", pending_persona_key)
+                                    pending_voice = change.get("voice", pending_voice)
+                                if responses: await session.send_tool_response(function_responses=responses)
+
+                            if close_reason == "shutdown_to_sleep":
+                                # Stop pumping mic audio and drop the socket now rather than
+                                # draining a final utterance through receive().
+                                mic_enabled.clear()
+                                await session.close()
+                            if close_reason: break
+                        if not close_reason: close_reason = activity["close_reason"] or "server_closed"
+                        raise _SessionDone()
+                except* _SessionDone:
+                    pass
+                except* (ConnectionClosed, ConnectionClosedOK):
+                    close_reason = close_reason or activity["close_reason"] or "server_closed"
+
+        except (ConnectionClosed, ConnectionClosedOK): close_reason = close_reason or activity["close_reason"] or "server_closed"
+        except Exception as e:
+            if isinstance(e, ExceptionGroup): e = e.exceptions[0]
+            close_reason = close_reason or activity["close_reason"] or f"error: {e}"
         finally:
-            if keepalive_task: keepalive_task.cancel()
-            if send_task: send_task.cancel()
-            print(f"[SESSION] Closing session. Reason: {close_reason or 'client'}", file=sys.stderr)
+            if activity["idle_timer"]: activity["idle_timer"].cancel()
+            if activity["keepalive_timer"]: activity["keepalive_timer"].cancel()
+            if activity["keepalive_ping"]: activity["keepalive_ping"].cancel()
+            if activity["memory_timer"]: activity["memory_timer"].cancel()
+            if activity["closing"]:
+                try:
+                    await activity["closing"]
+                except Exception as e:
+                    log.warning(f"Idle close failed: {e}")
+            cancel_led_pulse()
+            flush_playback()
+            flush_transcripts()
+            log.warning(f"Closing session. Reason: {close_reason or 'client'}")
 
         if close_reason == "persona_switch":
+            # Nothing failed, so reconnect straight away with a fresh backoff.
             state.set_persona(pending_persona_key, pending_voice)
-            await asyncio.sleep(RECONNECT_BACKOFF_SECONDS); continue
+            reconnect_attempt = 0; backoff = RECONNECT_BACKOFF_SECONDS; outage_started = None
+            continue
 
-        if state.current_state != state.RobotState.LISTENING:
+        if state.current_state != LISTENING:
             break
 
-        if close_reason == "server_closed" or (time.monotonic() - start_of_session) < SESSION_SHORT_LIFETIME_S:
+        now = time.monotonic()
+        if now - start_of_session >= SESSION_SHORT_LIFETIME_S:
+            # A healthy session that the server ended: reconnect right away.
+            if close_reason == "server_closed":
+                reconnect_attempt = 0; backoff = RECONNECT_BACKOFF_SECONDS; outage_started = None
+                continue
+        else:
             if not SESSION_INFINITE_RETRY and reconnect_attempt >= 3: break
+            if outage_started is None:
+                outage_started = start_of_session
+            elif now - outage_started > RECONNECT_DEADLINE_S:
+                log.warning(f"Could not hold a session for {RECONNECT_DEADLINE_S:.0f}s; going back to sleep")
+                break
             reconnect_attempt += 1
-            await asyncio.sleep(backoff); backoff = min(backoff * 1.7, MAX_BACKOFF_SECONDS); continue
+            # Decorrelated jitter keeps retries from lining up with other clients.
+            sleep_for = min(random.uniform(RECONNECT_BACKOFF_SECONDS, backoff * 3), MAX_BACKOFF_SECONDS)
+            await asyncio.sleep(sleep_for); backoff = sleep_for; continue
         
         break
 
-    if mic_stream: mic_stream.close()
-    if spk_stream: spk_stream.close()
-    if p: p.terminate()
+    # Give a goodbye line a moment to finish before the wake word listener starts
+    # hearing the speaker; the ring keeps draining on its own after that anyway.
+    for _ in range(10):
+        if not speaker_busy():
+            break
+        await asyncio.sleep(0.05)
+
+    # Release the capture device for the wake word listener; the speaker stays open.
+    mic_stream.stop_stream()
+    mic_stream.close()
@@ -0,0 +1,36 @@
+# silence_gate.py
+# The mic upload gate's state machine, kept free of audio and network imports
+# so the decisions it makes can be checked on their own.
+
+
+class SilenceGate:
+    """Decides which mic chunks to upload around a run of quiet ones.
+
+    After `hangover` quiet chunks in a row the gate closes: further quiet chunks
+    are held back (only the latest is kept) and the caller is told once to end
+    the audio stream. The next loud chunk reopens it, preceded by the held chunk
+    as pre-roll.
+    """
+
+    __slots__ = ("hangover", "quiet_run", "held")
+
+    def __init__(self, hangover: int):
+        self.hangover = hangover
+        self.quiet_run = 0
+        self.held = None
+
+    def drop_held(self):
+        """Forgets the pre-roll chunk, e.g. while the mic is muted."""
+        self.held = None
+
+    def feed(self, chunk, quiet: bool):
+        """Returns (chunks to send, in order; whether to send audio_stream_end first)."""
+        if quiet:
+            self.quiet_run += 1
+            if self.quiet_run > self.hangover:
+                self.held = chunk
+                return (), self.quiet_run == self.hangover + 1
+            return (chunk,), False
+        held, self.held = self.held, None
+        self.quiet_run = 0
+        return ((chunk,) if held is None else (held, chunk)), False
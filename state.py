@@ -29,10 +29,23 @@ conversation_buffer = deque(maxlen=CONVO_MAX_TURNS)
 session_custom_instructions = None
 concierge_waiting_for_description = False
 startup_hint = None
+# Personas whose Firestore history has been replayed this process. Survives
+# reset_session_state() on purpose: the history already lives in PersonaMemory's
+# short-term memory, and replaying it again on each wake would duplicate turns.
+history_hydrated = set()
 
 # Memory manager reference
 current_memory_manager = None
 
+# Number of speaker frames dropped because the playback queue was saturated
+playback_q_watermark = 0
+
+# Cached output of render_memory_recency(); rebuilt only after a mutation
+_memory_cache = None
+_memory_dirty = True
+# Bumped on every invalidation so callers can key their own caches on it
+memory_version = 0
+
 # =========================
 # State Management Functions
 # =========================
@@ -46,6 +59,7 @@ def set_persona(persona_key, voice_name):
     active_voice_name = voice_name
     # Initialize memory manager for the persona
     current_memory_manager = get_memory_manager(persona_key)
+    invalidate_memory_recency()
     
     # --- NEW: Initialize persona-specific Firestore memory ---
     from firestore_memory import initialize_firestore_memory
@@ -66,50 +80,80 @@ def reset_session_state():
     startup_hint = None
     # BUG FIX: Update the timestamp when a session ends for the cooldown logic.
     last_session_end = time.monotonic()
+    invalidate_memory_recency()
     
-    # Save memories when session ends
+    # Save memories when session ends. The JSON write happens on a worker thread
+    # so returning to wake-word listening isn't held up by SD-card I/O.
     if current_memory_manager:
-        current_memory_manager.save_memories()
+        current_memory_manager.save_memories_in_background()
 
 def cleanup_memories():
     """Save all memories and perform cleanup."""
     cleanup_all_memories()
 
+def invalidate_memory_recency():
+    """Marks the rendered memory context stale so the next render rebuilds it."""
+    global _memory_dirty, memory_version
+    _memory_dirty = True
+    memory_version += 1
+
+# Line prefixes for the fallback render; the buffer keeps plain role names.
+_ROLE_PREFIX = {"user": "User: ", "assistant": "Assistant: "}
+
+def _clip(text):
+    """Trims a turn to what the fallback context renders, once when it's stored."""
+    return (text[:300]+"…") if len(text)>300 else text
+
+def load_utterances(pairs):
+    """Seeds the buffer with (role, text) history in one pass, without saving it back to Firestore."""
+    pairs = [(role, text) for role, text in ((role, text.strip()) for role, text in pairs if text) if text]
+    conversation_buffer.extend((role, _clip(text)) for role, text in pairs)
+    if current_memory_manager:
+        for role, text in pairs:
+            current_memory_manager.add_short_term_memory(role, text)
+    invalidate_memory_recency()
+
 def add_user_utt(text: str):
+    # Stripped once and shared by the buffer, memory system and Firestore.
+    text = text.strip() if text else ""
     if text: 
-        conversation_buffer.append(("user", text.strip()))
+        conversation_buffer.append(("user", _clip(text)))
+        invalidate_memory_recency()
         # Add to memory system
         if current_memory_manager:
-            current_memory_manager.add_short_term_memory("user", text.strip())
+            current_memory_manager.add_short_term_memory("user", text)
         
         # --- NEW: Add to Firestore memory for persistent storage ---
+        # Queued for the background writer; the voice loop doesn't wait on the network.
         firestore_memory = get_firestore_memory()
         if firestore_memory:
-            try:
-                # This will automatically save to Firestore
-                firestore_memory.conversation_memory.chat_memory.add_user_message(text.strip())
-                print(f"[FIRESTORE] User message saved to Firestore: {text[:50]}...")
-            except Exception as e:
-                print(f"[FIRESTORE] Error saving user message: {e}")
+            firestore_memory.save_message_in_background("user", text)
 
 def add_assistant_utt(text: str):
+    # Stripped once and shared by the buffer, memory system and Firestore.
+    text = text.strip() if text else ""
     if text: 
-        conversation_buffer.append(("assistant", text.strip()))
+        conversation_buffer.append(("assistant", _clip(text)))
+        invalidate_memory_recency()
         # Add to memory system
         if current_memory_manager:
-            current_memory_manager.add_short_term_memory("assistant", text.strip())
+            current_memory_manager.add_short_term_memory("assistant", text)
         
         # --- NEW: Add to Firestore memory for persistent storage ---
+        # Queued for the background writer; the voice loop doesn't wait on the network.
         firestore_memory = get_firestore_memory()
         if firestore_memory:
-            try:
-                # This will automatically save to Firestore
-                firestore_memory.conversation_memory.chat_memory.add_ai_message(text.strip())
-                print(f"[FIRESTORE] Assistant message saved to Firestore: {text[:50]}...")
-            except Exception as e:
-                print(f"[FIRESTORE] Error saving assistant message: {e}")
+            firestore_memory.save_message_in_background("assistant", text)
 
 def render_memory_recency():
+    """Returns the memory context, re-rendering only if something changed since the last call."""
+    global _memory_cache, _memory_dirty
+    if _memory_dirty or _memory_cache is None:
+        _memory_cache = _render_memory_recency()
+        _memory_dirty = False
+    return _memory_cache
+
+def _render_memory_recency():
     # Use advanced memory system if available
     if current_memory_manager:
         memory_context = current_memory_manager.generate_context_prompt()
@@ -117,9 +161,12 @@ def render_memory_recency():
         memory_context = ""
     
     # --- NEW: Add Firestore conversation context ---
+    # Every turn goes to both stores (and history is seeded into short-term memory),
+    # so Firestore's last messages would only repeat the memory manager's "Recent
+    # conversation" block; it is read only when that block is empty.
     firestore_memory = get_firestore_memory()
     firestore_context = ""
-    if firestore_memory:
+    if firestore_memory and not (current_memory_manager and current_memory_manager.short_term_memory):
         try:
             firestore_context = firestore_memory.get_conversation_context(max_messages=5)
         except Exception as e:
@@ -136,12 +183,8 @@ def render_memory_recency():
     if not context_parts:
         if not conversation_buffer: 
             return "Recent context: (empty)"
-        lines=[]
-        for role, t in conversation_buffer:
-            who="User" if role=="user" else "Assistant"
-            t=(t[:300]+"…") if len(t)>300 else t
-            lines.append(f"{who}: {t}")
-        return "Recent context:\n" + "\n".join(lines)
+        # Turns were already clipped to 300 characters when they were stored.
+        return "Recent context:\n" + "\n".join(_ROLE_PREFIX[role] + t for role, t in conversation_buffer)
     
     return "\n\n".join(context_parts)
 
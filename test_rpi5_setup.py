@@ -7,16 +7,17 @@ import os
 import platform
 import subprocess
 import importlib.util
+from concurrent.futures import ProcessPoolExecutor
 
 def test_python_version():
     """Test Python version compatibility"""
     print("Testing Python version...")
     version = sys.version_info
-    if version.major >= 3 and version.minor >= 9:
+    if version >= (3, 11):
         print(f"✓ Python {version.major}.{version.minor}.{version.micro} - Compatible")
         return True
     else:
-        print(f"✗ Python {version.major}.{version.minor}.{version.micro} - Requires Python 3.9+")
+        print(f"✗ Python {version.major}.{version.minor}.{version.micro} - Requires Python 3.11+ (asyncio.TaskGroup, except*)")
         return False
 
 def test_platform():
@@ -35,6 +36,14 @@ def test_platform():
         print("⚠ Cannot determine platform")
         return True
 
+def _try_import(package):
+    """Imports `package` in a worker process; True if it loads."""
+    try:
+        importlib.import_module(package)
+        return True
+    except ImportError:
+        return False
+
 def test_required_packages():
     """Test if required Python packages are installed"""
     print("Testing required packages...")
@@ -43,17 +52,16 @@ def test_required_packages():
         'openwakeword', 'onnxruntime', 'serial', 'RPi.GPIO'
     ]
     
+    # Each import loads native libraries; doing them in parallel worker processes
+    # overlaps that load time. Results are still printed in the list's order.
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(_try_import, required_packages))
+    
     missing_packages = []
-    for package in required_packages:
-        try:
-            if package == 'google.genai':
-                import google.genai
-            elif package == 'serial':
-                import serial
-            else:
-                __import__(package)
+    for package, ok in zip(required_packages, results):
+        if ok:
             print(f"✓ {package}")
-        except ImportError:
+        else:
             print(f"✗ {package} - Missing")
             missing_packages.append(package)
     
@@ -106,8 +114,7 @@ def test_serial_devices():
     """Test serial device detection"""
     print("Testing serial devices...")
     try:
-        import glob
-        usb_devices = glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyACM*')
+        usb_devices = sorted(e.path for e in os.scandir('/dev') if e.name.startswith(('ttyUSB', 'ttyACM')))
         if usb_devices:
             print(f"✓ Found USB serial devices: {usb_devices}")
             return True
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Test for the mic silence gate (silence_gate.SilenceGate) used by session_manager._send_audio.
+Checks that closing the gate asks for audio_stream_end exactly once per silence,
+and that reopening it sends the held pre-roll chunk before the new audio.
+Imports nothing but the gate, so it needs no audio hardware, API key or serial port.
+Run with: python -m unittest test_vad_stream_end
+"""
+
+import unittest
+
+from silence_gate import SilenceGate
+
+HANGOVER = 2
+QUIET = b"q" * 4
+LOUD = b"L" * 4
+
+
+def run_gate(chunks, muted_at=()):
+    """Feeds chunks through a gate and returns the resulting send/end-of-stream events."""
+    gate = SilenceGate(HANGOVER)
+    events = []
+    for i, chunk in enumerate(chunks):
+        if i in muted_at:
+            gate.drop_held()
+            continue
+        to_send, end_stream = gate.feed(chunk, chunk == QUIET)
+        if end_stream:
+            events.append("END")
+        events.extend(to_send)
+    return events
+
+
+class VadStreamEndTest(unittest.TestCase):
+
+    def test_gate_close_sends_stream_end_once(self):
+        events = run_gate([LOUD] + [QUIET] * (HANGOVER + 5))
+        self.assertEqual(events.count("END"), 1)
+        # Speech plus the hangover chunks went out before the end-of-stream signal.
+        self.assertEqual(events, [LOUD] + [QUIET] * HANGOVER + ["END"])
+
+    def test_no_stream_end_within_hangover(self):
+        events = run_gate([LOUD] + [QUIET] * HANGOVER)
+        self.assertNotIn("END", events)
+
+    def test_reopen_sends_preroll_then_chunk(self):
+        events = run_gate([QUIET] * (HANGOVER + 2) + [LOUD])
+        self.assertEqual(events[-2:], [QUIET, LOUD])
+        self.assertEqual(events.count("END"), 1)
+
+    def test_each_silence_ends_the_stream_again(self):
+        silence = [QUIET] * (HANGOVER + 1)
+        events = run_gate([LOUD] + silence + [LOUD] + silence)
+        self.assertEqual(events.count("END"), 2)
+
+    def test_muting_drops_preroll(self):
+        chunks = [QUIET] * (HANGOVER + 2) + [LOUD]
+        events = run_gate(chunks, muted_at={HANGOVER + 2 - 1})
+        self.assertEqual(events[-1], LOUD)
+        self.assertNotEqual(events[-2], QUIET)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,35 +1,132 @@
 # utils.py
 # Contains common helper functions used across multiple modules.
 
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
 import re
 import sys
+import threading
 from pathlib import Path
-from config import SHUTDOWN_EXACT
+from config import CONFIG, SHUTDOWN_EXACT
+
+# All diagnostic loggers share one queue; a background listener thread does the
+# actual stdout writes so callers on the audio path never block on stdio.
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+
+def get_logger(tag: str) -> logging.Logger:
+    """Returns a queue-backed logger that prints records as "[TAG] message"."""
+    global _log_listener
+    if _log_listener is None:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("[%(name)s] %(message)s"))
+        _log_listener = logging.handlers.QueueListener(_log_queue, handler)
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+    logger = logging.getLogger(tag)
+    if not logger.handlers:
+        logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]")
+_WS_RE = re.compile(r"\s+")
+_VERSION_SUFFIX_RE = re.compile(r"_v\d+(\.\d+)*$")
+# One translate() pass instead of chained replace() calls for model names.
+_CANON_TABLE = str.maketrans({" ": "_", "-": "_"})
+_PRETTY_TABLE = str.maketrans({"_": " ", "-": " "})
+# Same match as `SHUTDOWN_EXACT in normalize_text(s)`, but in a single C-level scan:
+# any run of punctuation/whitespace may separate the phrase's words.
+_SHUTDOWN_RE = re.compile(r"[^a-z0-9]+".join(map(re.escape, SHUTDOWN_EXACT.split())), re.IGNORECASE)
 
 def normalize_text(s: str) -> str:
     """Normalizes text for keyword matching."""
     s = s.lower()
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _NON_ALNUM_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
 def says_shutdown(s: str) -> bool:
     """Checks if a string contains the shutdown phrase."""
     if not s:
         return False
-    n = normalize_text(s)
-    return SHUTDOWN_EXACT in n
+    return _SHUTDOWN_RE.search(s) is not None
 
 def canonical_model_key(s: str) -> str:
     """Normalize a model name/path into a canonical-ish key."""
-    stem = Path(s).stem.lower()
-    stem = stem.replace(" ", "_").replace("-", "_")
-    return stem
+    return Path(s).stem.lower().translate(_CANON_TABLE)
 
 def pretty_model_name(s: str) -> str:
     """Cleans up a model path/name for display."""
     base = Path(s).stem
-    base = re.sub(r"_v\d+(\.\d+)*$", "", base)  # drop version suffix like _v0.1
-    base = base.replace("_", " ").replace("-", " ")
+    base = _VERSION_SUFFIX_RE.sub("", base)  # drop version suffix like _v0.1
+    base = base.translate(_PRETTY_TABLE)
     return base.title()
 
+
+# =========================
+# Realtime Scheduling (opt-in via `main.py --rt`)
+# =========================
+_realtime_enabled = False
+# Audio backends that name their threads; PortAudio's own ALSA callback thread is
+# unnamed and so keeps the process's comm, which _is_audio_thread also accepts
+# once Python's own threads have been ruled out.
+_AUDIO_COMM_RE = re.compile(r"portaudio|alsa|pulse|pipewire|jack", re.IGNORECASE)
+
+def enable_realtime_scheduling():
+    """Pins the process to its own core so PortAudio threads can get another one."""
+    global _realtime_enabled
+    try:
+        os.sched_setaffinity(0, {CONFIG["rpi5"]["rt_main_cpu"]})
+    except (AttributeError, OSError) as e:
+        get_logger("RT").warning(f"Could not pin main process: {e}")
+    _realtime_enabled = True
+
+def _thread_comm(tid) -> str:
+    try:
+        return Path(f"/proc/self/task/{tid}/comm").read_text().strip()
+    except OSError:
+        return ""
+
+def _is_audio_thread(tid, process_comm: str, python_tids: set) -> bool:
+    # Python's own threads (log listener, asyncio.to_thread workers, the Firestore
+    # writer) may start while a stream opens but must stay on the normal scheduler.
+    # They keep the process's comm on Python < 3.14, so the name alone can't tell them
+    # apart from PortAudio's; their native thread IDs can.
+    if tid in python_tids:
+        return False
+    comm = _thread_comm(tid)
+    return bool(comm) and (comm == process_comm or _AUDIO_COMM_RE.search(comm) is not None)
+
+def audio_thread_snapshot() -> set:
+    """Returns the current thread IDs so threads spawned by PortAudio can be found later."""
+    if not _realtime_enabled:
+        return set()
+    try:
+        return {int(tid) for tid in os.listdir("/proc/self/task")}
+    except OSError:
+        return set()
+
+def promote_audio_threads(before: set):
+    """Moves threads created since `before` to the audio core with SCHED_FIFO priority."""
+    if not _realtime_enabled:
+        return
+    try:
+        new_tids = {int(tid) for tid in os.listdir("/proc/self/task")} - before
+    except OSError:
+        return
+    rt = CONFIG["rpi5"]
+    process_comm = _thread_comm(os.getpid())
+    python_tids = {t.native_id for t in threading.enumerate()}
+    for tid in new_tids:
+        if not _is_audio_thread(tid, process_comm, python_tids):
+            continue
+        try:
+            os.sched_setaffinity(tid, {rt["rt_audio_cpu"]})
+            os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(rt["rt_audio_priority"]))
+        except (AttributeError, OSError) as e:
+            get_logger("RT").warning(f"Could not promote audio thread {tid}: {e}")
@@ -7,46 +7,15 @@ from pathlib import Path
 import re
 
 import numpy as np
-import pyaudio
 from openwakeword.model import Model
 import openwakeword as oww
 import onnxruntime as ort
 
 import state
-from config import CONFIG, DESIRED_WAKE_MODELS, WAKE_THRESH, POST_SESSION_COOLDOWN_S, ARMING_DELAY_S, PERSONAS
+from config import CONFIG, DESIRED_WAKE_MODELS, WAKE_THRESH, POST_SESSION_COOLDOWN_S, ARMING_DELAY_S, PERSONAS, DEBUG_WAKE_SCORES
 from utils import pretty_model_name, canonical_model_key
-
-# =========================
-# USB Audio Detection for Raspberry Pi 5
-# =========================
-def _detect_usb_microphone():
-    """
-    Auto-detect USB microphone device index for Raspberry Pi 5.
-    Returns None if no USB microphone is found.
-    """
-    try:
-        p = pyaudio.PyAudio()
-        info = p.get_host_api_info_by_index(0)
-        num_devices = info.get('deviceCount')
-        
-        for i in range(num_devices):
-            device_info = p.get_device_info_by_host_api_device_index(0, i)
-            device_name = device_info.get('name', '').lower()
-            
-            # Look for USB audio devices
-            if (device_info.get('maxInputChannels') > 0 and 
-                any(keyword in device_name for keyword in ['usb', 'audio', 'microphone', 'mic'])):
-                print(f"[WAKE_WORD] Found USB microphone: Device {i} - {device_info.get('name')}")
-                p.terminate()
-                return i
-        
-        print("[WAKE_WORD] No USB microphone found, using default device")
-        p.terminate()
-        return None
-        
-    except Exception as e:
-        print(f"[WAKE_WORD] Error detecting USB microphone: {e}")
-        return None
+# One PortAudio context and one USB probe for the whole process, shared with the Live session
+from audio_devices import open_mic_stream
 
 # Suppress the benign ONNX warnings
 ort.set_default_logger_severity(3)
@@ -61,17 +30,31 @@ def _models_dir() -> Path:
     except Exception:
         return Path(".")
 
+# The package location doesn't move while the process runs.
+_MODELS_DIR = _models_dir()
+
+_MULTI_UNDERSCORE_RE = re.compile(r"_+")
+_VERSION_SUFFIX_RE = re.compile(r"_v\d+(\.\d+)*$")
+# Successful lookups only: while models are missing the listener keeps re-scanning
+# so it notices them once they're installed. Dropped by _reset_wake_model() too,
+# so a model file that was removed or replaced is looked up again after a failure.
+_discovered_models = {}
+
 def _discover_installed_models(desired_names):
-    mdir = _models_dir()
+    cache_key = tuple(desired_names)
+    if cache_key in _discovered_models:
+        return _discovered_models[cache_key]
+
+    mdir = _MODELS_DIR
     def norm(s: str) -> str:
         s = Path(s).stem.lower().replace("-", "_").replace(" ", "_")
-        return re.sub(r"_+", "_", s)
+        return _MULTI_UNDERSCORE_RE.sub("_", s)
 
     onnx_by_key = {norm(p.stem): p for p in mdir.glob("*.onnx")}
     available, missing = [], []
     for name in desired_names:
         key_exact = norm(name)
-        key_base = re.sub(r"_v\d+(\.\d+)*$", "", key_exact)
+        key_base = _VERSION_SUFFIX_RE.sub("", key_exact)
         candidate = None
         if key_exact in onnx_by_key:
             candidate = onnx_by_key[key_exact]
@@ -84,17 +67,34 @@ def _discover_installed_models(desired_names):
             available.append(str(candidate))
         else:
             missing.append(name)
+    if available:
+        _discovered_models[cache_key] = (available, missing)
     return available, missing
 
+# The ONNX sessions are built once and reused across wake cycles; they're only
+# rebuilt if the set of installed models changes or a listen attempt fails.
+_oww_model = None
+_oww_model_paths = None
+
+def _reset_wake_model():
+    global _oww_model, _oww_model_paths
+    _oww_model = _oww_model_paths = None
+    _discovered_models.clear()
+
+def _get_wake_model(available):
+    global _oww_model, _oww_model_paths
+    if _oww_model is None or _oww_model_paths != available:
+        _oww_model = Model(wakeword_models=available, inference_framework="onnx")
+        _oww_model_paths = list(available)
+    else:
+        # Clear the previous cycle's audio/score buffers so old speech can't re-trigger.
+        _oww_model.reset()
+    return _oww_model
+
 # =========================
 # Main Wake Word Listener Loop
 # =========================
 def run_wake_word_listener():
-    # !!! IMPORTANT !!!
-    # Auto-detect USB microphone for Raspberry Pi 5
-    # Run list_audio_devices.py to find the correct device index
-    MIC_DEVICE_INDEX = _detect_usb_microphone() 
-    
     backoff = 1.0
     while state.current_state == state.RobotState.SLEEPING:
         cooldown_left = max(0.0, POST_SESSION_COOLDOWN_S - (time.monotonic() - state.last_session_end))
@@ -108,19 +108,15 @@ def run_wake_word_listener():
             time.sleep(min(backoff, 5.0)); backoff = min(backoff * 1.6, 5.0)
             continue
 
-        p = None; mic = None
+        mic = None
         try:
-            owwModel = Model(wakeword_models=available, inference_framework="onnx")
+            owwModel = _get_wake_model(available)
             backoff = 1.0
 
-            p = pyaudio.PyAudio()
-            
-            # --- MODIFIED: Added input_device_index ---
-            # This tells PyAudio exactly which microphone to listen to.
-            mic = p.open(rate=CONFIG["audio"]["rate"], channels=CONFIG["audio"]["channels"],
-                         format=CONFIG["audio"]["format"], input=True,
-                         frames_per_buffer=CONFIG["audio"]["chunk_size"],
-                         input_device_index=MIC_DEVICE_INDEX)
+            # !!! IMPORTANT !!!
+            # The USB microphone is auto-detected (once per process) by the shared
+            # opener; run list_audio_devices.py to find the correct device index.
+            mic = open_mic_stream()
             
             pretty_targets = ", ".join([pretty_model_name(n) for n in available])
             print(f"[WAKE_WORD] Listening for: {pretty_targets}")
@@ -133,16 +129,33 @@ def run_wake_word_listener():
             weather_path = model_paths.get('weather_v0.1')
 
             start_t = time.monotonic()
-            while state.current_state == state.RobotState.SLEEPING:
-                data = mic.read(CONFIG["audio"]["chunk_size"])
-                arr = np.frombuffer(data, dtype=np.int16)
-                pred = owwModel.predict(arr)
+            # Bound once here; this loop runs every 80 ms for as long as the robot sleeps.
+            sleeping = state.RobotState.SLEEPING
+            chunk_size = CONFIG["audio"]["chunk_size"]
+            mic_read = mic.read
+            predict = owwModel.predict
+            frombuffer = np.frombuffer
+            int16 = np.int16
+            show_scores = __debug__ and DEBUG_WAKE_SCORES
+            stems = {}  # Model key -> display stem, filled on the first debug frame
+            debug_frame = 0
+            while state.current_state == sleeping:
+                pred = predict(frombuffer(mic_read(chunk_size), dtype=int16))
 
                  # --- DEBUGGING RESTORED ---
                 # This line prints the live scores from the model to the console.
                 # It uses a carriage return `\r` to update the line in place.
-                sys.stdout.write("\r[DEBUG] " + str({Path(k).stem: round(float(v), 5) for k, v in pred.items()}) + "   ")
-                sys.stdout.flush()
+                # Off by default (DEBUG_WAKE_SCORES); `python -O` drops it entirely.
+                # Refreshed every 10th frame (~0.8 s), which is plenty to read by eye.
+                if show_scores:
+                    debug_frame += 1
+                    if debug_frame % 10 == 1:
+                        if not stems:
+                            stems = {k: Path(k).stem for k in pred}
+                        sys.stdout.write("\r[DEBUG] " + str({stems[k]: round(float(v), 5) for k, v in pred.items()}) + "   ")
+                        # No newline, so nothing else would push the line out; the
+                        # flush is cheap now that it only runs every 10th frame.
+                        sys.stdout.flush()
 
                 if pred.get('hey_jarvis_v0.1') >= 0.8:
                     state.set_persona("jarvis", PERSONAS["jarvis"]["voice"])
@@ -163,7 +176,8 @@ def run_wake_word_listener():
                     return
         except Exception as e:
             print(f"[WAKE_WORD] Error: {e}", file=sys.stderr)
+            _reset_wake_model()
             time.sleep(min(backoff, 5.0)); backoff = min(backoff * 1.6, 5.0)
         finally:
+            # The stream is released for the Live session; PyAudio itself stays up.
             if mic: mic.close()
-            if p: p.terminate()